@@ -6,15 +6,40 @@ CoachAI Logic - Gemini-Powered Goal Planning
 import os
 import json
 import re
+import math
+import functools
+import threading
+import orjson
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.S)
+_H_RE = re.compile(r'(\d+)\s*h')
+_M_RE = re.compile(r'(\d+)\s*m')
+_DIGITS_RE = re.compile(r'\d+')
+_JSON_DECODER = json.JSONDecoder()
+# orjson refuses to serialize ints outside the signed 64-bit range
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+GEMINI_GENERATE_URL = (
+    f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+)
+MAX_QUESTIONS = 10
+
+PLAN_CACHE_SIZE = 256
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
 # =============================================================================
 # GEMINI SETUP
 # =============================================================================
 
+@functools.lru_cache(maxsize=1)
 def setup_gemini():
-    """Initialize Gemini AI model"""
+    """Initialize Gemini AI model (built once per process)"""
     try:
         import google.generativeai as genai
     except ImportError:
@@ -25,41 +50,97 @@ def setup_gemini():
         raise RuntimeError("Set GEMINI_API_KEY environment variable")
 
     genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-2.0-flash-exp")
+    model = genai.GenerativeModel(GEMINI_MODEL)
     return model
 
 
+def create_gemini_client():
+    """Create an async HTTP client for the Gemini REST API"""
+    try:
+        import httpx
+    except ImportError:
+        raise RuntimeError("Run: pip install 'httpx[http2]'")
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Set GEMINI_API_KEY environment variable")
+
+    try:
+        return httpx.AsyncClient(
+            headers={"x-goog-api-key": api_key},
+            http2=True,
+            timeout=60,
+        )
+    except ImportError:
+        # httpx installed without the h2 extra
+        raise RuntimeError("Run: pip install 'httpx[http2]'")
+
+
+def _span_end(text: str, start: int, open_ch: str, close_ch: str) -> int:
+    """Index just past the balanced span opened at start, or len(text)"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == open_ch:
+            depth += 1
+        elif ch == close_ch:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(text)
+
+
 def extract_json(text: str):
     """Extract JSON from AI response"""
     if not text:
         return None
 
-    text = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', text, flags=re.S)
+    text = _FENCE_RE.sub('', text)
 
     try:
-        return json.loads(text)
-    except:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
         pass
 
-    for open_ch, close_ch in [('{', '}'), ('[', ']')]:
-        depth = 0
-        start = None
-        for i, ch in enumerate(text):
-            if ch == open_ch:
-                if depth == 0:
-                    start = i
-                depth += 1
-            elif ch == close_ch and depth:
-                depth -= 1
-                if depth == 0 and start is not None:
-                    try:
-                        return json.loads(text[start:i+1])
-                    except:
-                        pass
+    for open_ch, close_ch in (('{', '}'), ('[', ']')):
+        i = text.find(open_ch)
+        while i != -1:
+            try:
+                return _JSON_DECODER.raw_decode(text, i)[0]
+            except json.JSONDecodeError:
+                # Never fall back to objects nested inside a malformed one
+                i = text.find(open_ch, _span_end(text, i, open_ch, close_ch))
 
     return None
 
 
+def _parse_response(text: str, finish_reason: Optional[str] = None) -> Optional[dict]:
+    """Extract JSON from Gemini response text, logging the outcome"""
+    if not text:
+        print(f"[WARN] Gemini returned no text (finishReason={finish_reason})")
+        return None
+
+    data = extract_json(text)
+    if data:
+        print(f"[SUCCESS] Parsed JSON response")
+        return data
+    else:
+        print(f"[WARN] Could not parse JSON from response (finishReason={finish_reason})")
+        print(f"[DEBUG] Response text: {text[:200]}...")
+        return None
+
+
 def call_gemini(model, prompt: str, max_tokens: int = 4096) -> Optional[dict]:
     """Call Gemini and return JSON response"""
     try:
@@ -68,17 +149,12 @@ def call_gemini(model, prompt: str, max_tokens: int = 4096) -> Optional[dict]:
             generation_config={"max_output_tokens": max_tokens}
         )
         
+        candidates = getattr(response, "candidates", None) or []
+        finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+        finish_reason = getattr(finish_reason, "name", finish_reason)
+
         text = response.text if hasattr(response, 'text') else ""
-        
-        # Try to extract JSON
-        data = extract_json(text)
-        if data:
-            print(f"[SUCCESS] Parsed JSON response")
-            return data
-        else:
-            print(f"[WARN] Could not parse JSON from response")
-            print(f"[DEBUG] Response text: {text[:200]}...")
-            return None
+        return _parse_response(text, finish_reason)
             
     except Exception as e:
         print(f"[ERROR] Gemini call failed: {e}")
@@ -87,6 +163,36 @@ def call_gemini(model, prompt: str, max_tokens: int = 4096) -> Optional[dict]:
         return None
 
 
+async def call_gemini_async(client, prompt: str, max_tokens: int = 4096) -> Optional[dict]:
+    """Call the Gemini REST API without blocking the event loop"""
+    try:
+        response = await client.post(
+            GEMINI_GENERATE_URL,
+            json={
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": {"maxOutputTokens": max_tokens},
+            },
+        )
+        response.raise_for_status()
+
+        payload = orjson.loads(response.content)
+        candidates = payload.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        text = "".join(part.get("text", "") for part in parts)
+        # Blocked prompts carry no candidates, only promptFeedback
+        finish_reason = (
+            candidates[0].get("finishReason")
+            or (payload.get("promptFeedback") or {}).get("blockReason")
+        )
+        return _parse_response(text, finish_reason)
+
+    except Exception as e:
+        print(f"[ERROR] Gemini call failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
 # =============================================================================
 # HELPER FUNCTIONS
 # =============================================================================
@@ -103,12 +209,12 @@ def _parse_minutes(value) -> int:
         mins = 0
         try:
             if 'h' in s or 'm' in s:
-                h = re.search(r'(\d+)\s*h', s)
-                m = re.search(r'(\d+)\s*m', s)
+                h = _H_RE.search(s)
+                m = _M_RE.search(s)
                 if h: hours = int(h.group(1))
                 if m: mins = int(m.group(1))
                 if not h and not m:
-                    digits = re.findall(r'\d+', s)
+                    digits = _DIGITS_RE.findall(s)
                     if digits:
                         mins = int(digits[0])
                 return max(1, hours * 60 + mins)
@@ -128,6 +234,76 @@ def _format_hm(total_minutes: int) -> str:
     return f"{m}m"
 
 
+def _opt_str(value) -> Optional[str]:
+    """Keep strings, stringify numbers, drop anything else"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def _opt_number(value, cast):
+    """Coerce a number or numeric string with cast (int/float), else None.
+
+    Ints outside the signed 64-bit range are dropped to None.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        value = cast(value)
+        if isinstance(value, int) and not _INT64_MIN <= value <= _INT64_MAX:
+            return None
+        return value
+    return None
+
+
+def _opt_bool(value) -> Optional[bool]:
+    """Accept real booleans and 'true'/'false' strings, else None"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return None
+
+
+def _format_qa(qa_pairs: list) -> str:
+    """Render Q/A pairs as prompt text, one 'Q:'/'A:' block per pair"""
+    return "\n".join(f"Q: {qa['question']}\nA: {qa['answer']}" for qa in qa_pairs)
+
+
+def _plan_cache_key(goal: str, qa_pairs: list) -> tuple:
+    return (goal, tuple((qa['question'], qa['answer']) for qa in qa_pairs))
+
+
+def _lookup_plan(goal: str, qa_pairs: list) -> tuple:
+    """Return (cache key, previously generated plan or None); callers must not mutate the plan"""
+    key = _plan_cache_key(goal, qa_pairs)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+        return key, plan
+
+
+def _has_steps(data) -> bool:
+    """True if Gemini returned a real plan rather than something we'd replace"""
+    return isinstance(data, dict) and isinstance(data.get("steps"), list) and len(data["steps"]) > 0
+
+
+def _cache_plan(key: tuple, plan: dict) -> None:
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        _plan_cache.move_to_end(key)
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+
+
 def _sanitize_plan_dict(data: dict, goal: str) -> dict:
     """Coerce Gemini output into a shape that satisfies PlanResponse."""
     if not isinstance(data, dict):
@@ -148,45 +324,59 @@ def _sanitize_plan_dict(data: dict, goal: str) -> dict:
     for i, step in enumerate(steps, 1):
         if not isinstance(step, dict):
             step = {}
+        resources = step.get("resources")
+        if not isinstance(resources, list):
+            resources = []
         
         sanitized_steps.append({
             "step_number": i,
-            "do": step.get("do") or f"Step {i} task",
-            "why": step.get("why") or "Important for progress",
-            "check": step.get("check") or "Verify completion",
-            "resources": [str(r) for r in step.get("resources", []) if r] or ["Online resources"]
+            "do": str(step.get("do") or f"Step {i} task"),
+            "why": str(step.get("why") or "Important for progress"),
+            "check": str(step.get("check") or "Verify completion"),
+            "resources": [str(r) for r in resources if r] or ["Online resources"]
         })
 
     data["steps"] = sanitized_steps
 
     # Ensure tips is a list of strings
     tips = data.get("tips")
-    if isinstance(tips, list):
-        tips = [str(t) for t in tips if t]
+    tips = [str(t) for t in tips if t] if isinstance(tips, list) else []
     if not tips:
         tips = ["Stay consistent", "Track progress", "Adjust as you learn"]
     data["tips"] = tips
 
     # Ensure required fields exist
-    data["goal"] = data.get("goal") or goal
+    data["goal"] = str(data.get("goal") or goal)
+
+    # Optional fields are returned without further validation, so coerce
+    # them to the PlanResponse types or drop them to None
+    for key in ("original_goal", "goal_changed_reason",
+                "adjustment_explanation", "realistic_goal_level"):
+        data[key] = _opt_str(data.get(key))
+    data["total_minutes_calculated"] = _opt_number(data.get("total_minutes_calculated"), int)
+    data["user_requested_hours"] = _opt_number(data.get("user_requested_hours"), float)
+    data["timeline_adjusted"] = _opt_bool(data.get("timeline_adjusted"))
+
+    hours_needed = data.get("realistic_hours_needed")
+    if not isinstance(hours_needed, str):
+        hours_needed = _opt_number(hours_needed, float)
+        if hours_needed is not None and hours_needed.is_integer():
+            hours_needed = _opt_number(hours_needed, int)
+        elif hours_needed is not None:
+            hours_needed = str(hours_needed)
+    data["realistic_hours_needed"] = hours_needed
 
     return data
 
 # =============================================================================
 # MAIN API FUNCTIONS
 # =============================================================================
-def should_ask_more_questions(goal: str, qa_pairs: list) -> dict:
-    """
-    Decide if we need more questions or have enough to generate plan.
-    Max 10 questions, but can stop early.
-    """
-    model = setup_gemini()
-    qa_text = "\n".join([f"Q: {qa['question']}\nA: {qa['answer']}" for qa in qa_pairs])
-    
+def _continue_prompt(goal: str, qa_pairs: list) -> str:
+    """Build the prompt that asks Gemini whether to keep questioning"""
+    qa_text = _format_qa(qa_pairs)
     current_count = len(qa_pairs)
-    max_questions = 10
     
-    prompt = f"""Goal: {goal}
+    return f"""Goal: {goal}
 
 Information gathered so far ({current_count} questions answered):
 {qa_text}
@@ -194,7 +384,7 @@ Information gathered so far ({current_count} questions answered):
 Decide if you need MORE information or have ENOUGH to create an excellent plan.
 
 Guidelines:
-- Maximum {max_questions} questions total
+- Maximum {MAX_QUESTIONS} questions total
 - Only ask if the information is CRITICAL for the plan
 - Stop early if you have enough context
 - Consider: time, experience level, constraints, resources, context
@@ -208,8 +398,9 @@ Return JSON:
 
 Be efficient - quality over quantity."""
 
-    data = call_gemini(model, prompt, max_tokens=400)
-    
+
+def _continue_result(data, current_count: int) -> dict:
+    """Turn Gemini's ask/ready decision into an API response"""
     if not data or not isinstance(data, dict):
         # Fallback: if unsure, generate plan
         return {
@@ -219,22 +410,37 @@ Be efficient - quality over quantity."""
         }
     
     # Ensure we don't exceed max
-    if current_count >= max_questions:
+    if current_count >= MAX_QUESTIONS:
         return {
             "action": "ready",
             "question": None,
-            "reasoning": f"Reached maximum of {max_questions} questions"
+            "reasoning": f"Reached maximum of {MAX_QUESTIONS} questions"
         }
     
     return data
 
-def generate_plan(goal: str, qa_pairs: list) -> dict:
-    """Generate actionable plan with flexible implementation approaches"""
-    
+
+def should_ask_more_questions(goal: str, qa_pairs: list) -> dict:
+    """
+    Decide if we need more questions or have enough to generate plan.
+    Max 10 questions, but can stop early.
+    """
     model = setup_gemini()
-    qa_text = "\n".join([f"Q: {qa['question']}\nA: {qa['answer']}" for qa in qa_pairs])
+    data = call_gemini(model, _continue_prompt(goal, qa_pairs), max_tokens=400)
+    return _continue_result(data, len(qa_pairs))
+
+
+async def should_ask_more_questions_async(goal: str, qa_pairs: list, client) -> dict:
+    """Async variant of should_ask_more_questions using the Gemini REST client"""
+    data = await call_gemini_async(client, _continue_prompt(goal, qa_pairs), max_tokens=400)
+    return _continue_result(data, len(qa_pairs))
+
+
+def _plan_prompt(goal: str, qa_pairs: list) -> str:
+    """Build the plan-generation prompt"""
+    qa_text = _format_qa(qa_pairs)
     
-    prompt = f"""{goal}
+    return f"""{goal}
 
 {qa_text}
 
@@ -316,9 +522,10 @@ Return ONLY valid JSON:
 
 Be concrete about WHAT to achieve. Provide options for HOW to achieve it. Someone should be able to start immediately after reading each step."""
 
-    data = call_gemini(model, prompt, max_tokens=4096)
-    
-    if not data:
+
+def _plan_result(data, goal: str) -> dict:
+    """Sanitize Gemini's plan, or fall back to a single research step"""
+    if not data or not isinstance(data, dict):
         print("[WARN] Gemini failed, using fallback")
         return {
             "goal": goal,
@@ -333,3 +540,34 @@ Be concrete about WHAT to achieve. Provide options for HOW to achieve it. Someon
         }
     
     return _sanitize_plan_dict(data, goal)
+
+
+def _finish_plan(key: tuple, data, goal: str) -> dict:
+    """Build the plan from Gemini's data, caching it only if Gemini gave real steps"""
+    # Checked before _plan_result, which replaces data["steps"] in place
+    cacheable = _has_steps(data)
+    plan = _plan_result(data, goal)
+    if cacheable:
+        _cache_plan(key, plan)
+    return plan
+
+
+def generate_plan(goal: str, qa_pairs: list) -> dict:
+    """Generate actionable plan with flexible implementation approaches"""
+    key, cached = _lookup_plan(goal, qa_pairs)
+    if cached is not None:
+        return cached
+
+    model = setup_gemini()
+    data = call_gemini(model, _plan_prompt(goal, qa_pairs), max_tokens=4096)
+    return _finish_plan(key, data, goal)
+
+
+async def generate_plan_async(goal: str, qa_pairs: list, client) -> dict:
+    """Async variant of generate_plan using the Gemini REST client"""
+    key, cached = _lookup_plan(goal, qa_pairs)
+    if cached is not None:
+        return cached
+
+    data = await call_gemini_async(client, _plan_prompt(goal, qa_pairs), max_tokens=4096)
+    return _finish_plan(key, data, goal)
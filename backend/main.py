@@ -6,8 +6,14 @@ CoachAI FastAPI Backend
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import orjson
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import coach
 from typing import List, Optional, Union
 from pydantic import BaseModel
@@ -20,7 +26,33 @@ ALLOWED_ORIGINS = os.getenv(
     "ALLOWED_ORIGINS",
     "*"  # For Hugging Face, allow all (or specify your Vercel domain)
 ).split(",")
-app = FastAPI(title="CoachAI API")
+
+# Sync Gemini SDK fallback runs in the loop's default executor
+MAX_WORKER_THREADS = int(os.getenv("MAX_WORKER_THREADS", "64"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKER_THREADS)
+    asyncio.get_running_loop().set_default_executor(executor)
+
+    # Async REST client multiplexes Gemini calls on the event loop
+    try:
+        app.state.gemini = coach.create_gemini_client()
+    except RuntimeError as e:
+        print(f"[WARN] Async Gemini client unavailable, using SDK fallback: {e}")
+        app.state.gemini = None
+
+    yield
+
+    if app.state.gemini is not None:
+        await app.state.gemini.aclose()
+    executor.shutdown(wait=False)
+
+
+app = FastAPI(title="CoachAI API", lifespan=lifespan, default_response_class=ORJSONResponse)
+# Without lifespan (e.g. TestClient outside a with-block) endpoints use the SDK fallback
+app.state.gemini = None
 
 app.add_middleware(
     CORSMiddleware,
@@ -91,22 +123,29 @@ async def root():
     return {"message": "CoachAI API is running"}
 
 
+# Static payload, encoded once at import
+_CLARIFY_BODY = orjson.dumps({
+    "questions": [
+        "How much time do you have to achieve this goal? (e.g., '5 days', '3 months', '2 hours per week for 6 months')"
+    ]
+})
+
+
 @app.post("/api/clarify", response_model=ClarifyResponse)
 async def clarify(request: ClarifyRequest):
     """Return initial time question"""
     # Just return the time question - let /api/continue handle adaptive questions
-    return {
-        "questions": [
-            "How much time do you have to achieve this goal? (e.g., '5 days', '3 months', '2 hours per week for 6 months')"
-        ]
-    }
+    return Response(content=_CLARIFY_BODY, media_type="application/json")
 
 @app.post("/api/continue", response_model=ContinueResponse)
 async def continue_conversation(request: ContinueRequest):
     """Decide if we need more questions or can generate plan"""
     try:
         qa_pairs = [{"question": qa.question, "answer": qa.answer} for qa in request.qa_pairs]
-        result = coach.should_ask_more_questions(request.goal, qa_pairs)
+        if app.state.gemini is not None:
+            result = await coach.should_ask_more_questions_async(request.goal, qa_pairs, app.state.gemini)
+        else:
+            result = await asyncio.to_thread(coach.should_ask_more_questions, request.goal, qa_pairs)
         return result
     except Exception as e:
         print(f"[ERROR] Continue conversation failed: {e}")
@@ -120,13 +159,21 @@ async def continue_conversation(request: ContinueRequest):
         }
 
 
+# coach._sanitize_plan_dict already normalizes plans, so /api/plan
+# returns them directly instead of re-validating through PlanResponse
+_PLAN_FIELDS = tuple(PlanResponse.model_fields)
+
+
 @app.post("/api/plan", response_model=PlanResponse)
 async def plan(request: PlanRequest):
     """Generate a complete plan"""
     try:
         qa_pairs = [{"question": qa.question, "answer": qa.answer} for qa in request.qa_pairs]
-        result = coach.generate_plan(request.goal, qa_pairs)
-        return result
+        if app.state.gemini is not None:
+            result = await coach.generate_plan_async(request.goal, qa_pairs, app.state.gemini)
+        else:
+            result = await asyncio.to_thread(coach.generate_plan, request.goal, qa_pairs)
+        return ORJSONResponse({k: result[k] for k in _PLAN_FIELDS if k in result})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 